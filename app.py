@@ -6,49 +6,169 @@ Description:
     Flask web app for comparing RTF files with configurable options and HTML reports.
 """
 
+import hashlib
+import mmap
 import os
+import pickle
+import secrets
+import stat
 import tempfile
-import uuid
+import threading
+import time
 import shutil
 import csv
 import io
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from pathlib import Path
 
-from flask import Flask, request, render_template, jsonify, send_file, flash, redirect, url_for, session
+from flask import Flask, Request, Response, request, make_response, render_template, jsonify, send_file, flash, redirect, url_for, session
+from flask_session import Session
+from cachelib.file import FileSystemCache
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.formparser import default_stream_factory
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 
-from utils.rtf_processor import RTFProcessor
-from utils.diff_generator import DiffGenerator
+from utils.batch_compare import batch_compare, diff_generator
+
+# Minimum tmpfs size for /dev/shm to be used as the upload directory
+MIN_SHM_BYTES = 256 * 1024 * 1024
+
+def default_upload_folder():
+    """Prefer RAM-backed /dev/shm for session files, falling back to the temp dir"""
+    if 'RTF_UPLOAD_DIR' in os.environ:
+        return os.environ['RTF_UPLOAD_DIR']
+    try:
+        if os.access('/dev/shm', os.W_OK) and shutil.disk_usage('/dev/shm').total >= MIN_SHM_BYTES:
+            return '/dev/shm'
+    except OSError:
+        pass
+    return tempfile.gettempdir()
+
+def private_dir(path):
+    """
+    Create a directory only this user can access. An existing one must be
+    ours and not writable by others, since the app loads pickles and
+    template bytecode from it.
+    """
+    if os.name == 'nt':
+        # Windows reports every directory as mode 0o777 and has no POSIX
+        # owner to compare, so the checks below cannot apply
+        os.makedirs(path, exist_ok=True)
+        return path
+    path = Path(path)
+    try:
+        path.mkdir(mode=0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if (not stat.S_ISDIR(st.st_mode)
+            or st.st_uid != os.getuid()
+            or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+        raise RuntimeError(f"Refusing to use {path}: it must be a directory owned "
+                           "by this user and not writable by others")
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        os.chmod(path, 0o700)
+    return path
+
+# Write buffer for upload parts streamed into the session directory
+UPLOAD_WRITE_BUFSIZE = 1024 * 1024
+
+class UploadRequest(Request):
+    """Request that spools uploaded files straight into the session directory"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Staged upload files, deleted on close unless moved into place
+        self.staged_paths = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename:
+            return default_stream_factory(total_content_length, content_type, filename, content_length)
+        # A large buffer coalesces the parser's small chunks into few write() calls
+        stream = tempfile.NamedTemporaryFile('w+b', buffering=UPLOAD_WRITE_BUFSIZE,
+                                             dir=get_session_dir(), prefix='stage_', delete=False)
+        self.staged_paths.append(stream.name)
+        return stream
+
+    def close(self):
+        """Close uploaded files and delete any staged file that was not moved into place"""
+        super().close()
+        for path in self.staged_paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
 
 app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+app.request_class = UploadRequest
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 app.config['MAX_CONTENT_LENGTH'] = 15 * 1024 * 1024  # 15MB max file size
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+app.config['UPLOAD_FOLDER'] = default_upload_folder()
 
-# Initialize processors
-rtf_processor = RTFProcessor()
-diff_generator = DiffGenerator()
+# Server-side sessions: the cookie only carries the session id. Session
+# files are unpickled, so they live in a directory only this user can write
+app.config['SESSION_TYPE'] = 'cachelib'
+app.config['SESSION_CACHELIB'] = FileSystemCache(
+    cache_dir=str(private_dir(Path(app.config['UPLOAD_FOLDER']) / 'rtf_flask_sessions')),
+    threshold=1000
+)
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
+app.config.update(
+    SESSION_COOKIE_SAMESITE='Lax',
+    SESSION_COOKIE_HTTPONLY=True,
+    SESSION_REFRESH_EACH_REQUEST=False  # Only send Set-Cookie when the session changes
+)
+Session(app)
+
+# Cache compiled templates across worker restarts, and compile them once in
+# the preloading master so forked workers share the parsed templates
+jinja_cache_dir = private_dir(Path(app.config['UPLOAD_FOLDER']) / 'rtf_jinja_cache')
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(str(jinja_cache_dir))
+for template_name in ('index.html', 'results.html', 'diff.html'):
+    app.jinja_env.get_template(template_name)
+
+# Bounded LRU cache of comparison results keyed on file digests and options,
+# limited by entry count and by the total length of the cached diff HTML
+DIFF_CACHE_SIZE = 128
+DIFF_CACHE_MAX_CHARS = 32 * 1024 * 1024
+_diff_cache = OrderedDict()
+_diff_cache_chars = [0]
+_diff_cache_lock = threading.Lock()
+
+# Session cleanup runs at most once per interval (seconds) per worker
+CLEANUP_INTERVAL = 600
+_last_cleanup = [float('-inf')]
 
 def cleanup_old_sessions():
     """Clean up session directories older than 24 hours"""
-    upload_base = Path(app.config['UPLOAD_FOLDER'])
-    cutoff = datetime.now() - timedelta(hours=24)
+    cutoff = time.time() - 24 * 60 * 60
     
-    for session_dir in upload_base.glob('rtf_session_*'):
-        if session_dir.is_dir() and datetime.fromtimestamp(session_dir.stat().st_mtime) < cutoff:
-            shutil.rmtree(session_dir, ignore_errors=True)
+    # DirEntry caches the file type from the directory read, so each
+    # session directory costs at most one stat() call
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        for entry in entries:
+            if (entry.name.startswith('rtf_session_')
+                    and entry.is_dir(follow_symlinks=False)
+                    and entry.stat(follow_symlinks=False).st_mtime < cutoff):
+                shutil.rmtree(entry.path, ignore_errors=True)
 
 def get_session_dir():
     """Get or create session-specific upload directory"""
     if 'session_id' not in session:
-        session['session_id'] = str(uuid.uuid4())
+        session['session_id'] = secrets.token_urlsafe(12)
     
     session_dir = Path(app.config['UPLOAD_FOLDER']) / f"rtf_session_{session['session_id']}"
     session_dir.mkdir(exist_ok=True)
     return session_dir
 
+def save_upload(file_storage, dest):
+    """Move an upload, already staged in the session directory by UploadRequest, into place"""
+    stream = file_storage.stream
+    stream.close()
+    os.replace(stream.name, dest)
+
 def validate_rtf_file(file_path):
     """Validate that uploaded file is RTF format"""
     try:
@@ -56,32 +176,155 @@ def validate_rtf_file(file_path):
         if not file_path.suffix.lower() == '.rtf':
             return False, "File must have .rtf extension"
         
-        # Check file is not empty and is readable
+        # Check file is not empty and starts with the RTF signature
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read(50)  # Read first 50 chars
-                if not content.strip():
-                    return False, "File appears to be empty"
-                # Basic RTF format check - look for RTF signature
-                content_lower = content.lower()
-                if 'rtf' not in content_lower or '{' not in content:
-                    return False, "File does not appear to be valid RTF format"
-        except Exception:
-            return False, "File encoding is not supported"
+            with open(file_path, 'rb') as f:
+                # Some editors prefix the RTF with a UTF-8 byte order mark
+                head = f.read(512).removeprefix(b'\xef\xbb\xbf').lstrip()
+            if not head:
+                return False, "File appears to be empty"
+            if head[:5].lower() != b'{\\rtf':
+                return False, "File does not appear to be valid RTF format"
+        except OSError:
+            return False, "File could not be read"
         
         return True, None
     except Exception as e:
         return False, f"Error validating file: {str(e)}"
 
+def save_results(data):
+    """Persist comparison results in the session directory"""
+    results_path = get_session_dir() / 'results.pkl'
+    staged_path = results_path.with_suffix('.tmp')
+    with open(staged_path, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(staged_path, results_path)
+    session['results_path'] = str(results_path)
+    session['results_etag'] = hashlib.blake2b(
+        f"{results_path}:{data['timestamp']}".encode('utf-8'), digest_size=8
+    ).hexdigest()
+
+def load_results():
+    """Load comparison results for the current session, or None if unavailable"""
+    results_path = session.get('results_path')
+    if not results_path:
+        return None
+    try:
+        with open(results_path, 'rb') as f:
+            return pickle.load(f)
+    except OSError:
+        return None
+
+def iter_summary_csv(data):
+    """Yield the CSV summary of comparison results as encoded rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    def flush():
+        chunk = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+    
+    # Header
+    writer.writerow(['Source File', 'Comparison File', 'Has Differences', 
+                    'Total Changes', 'Insertions', 'Deletions', 'Timestamp'])
+    yield flush()
+    
+    # Data rows
+    for result in data['results']:
+        writer.writerow([
+            data['source_filename'],
+            result['filename'],
+            'Yes' if result['has_differences'] else 'No',
+            result['change_count'],
+            result['stats']['insertions'],
+            result['stats']['deletions'],
+            data['timestamp']
+        ])
+        yield flush()
+
+def write_report_files(session_dir, data):
+    """Pre-render the consolidated HTML report and CSV summary for download"""
+    report_path = session_dir / 'report.html'
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.writelines(diff_generator.iter_consolidated_report(
+            data['source_filename'],
+            data['results'],
+            data['options']
+        ))
+    
+    csv_path = session_dir / 'summary.csv'
+    with open(csv_path, 'wb') as f:
+        for chunk in iter_summary_csv(data):
+            f.write(chunk)
+    
+    data['report_path'] = str(report_path)
+    data['csv_path'] = str(csv_path)
+
+def file_digest(file_path):
+    """Return the BLAKE2b digest of a file's bytes, hashed in place via mmap"""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.blake2b(digest_size=16).digest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.blake2b(mm, digest_size=16).digest()
+
+def get_cached_diff(key):
+    """Return a cached comparison result, or None on a miss"""
+    with _diff_cache_lock:
+        result = _diff_cache.get(key)
+        if result is not None:
+            _diff_cache.move_to_end(key)
+        return result
+
+def store_cached_diff(key, result):
+    """Store a comparison result, evicting least recently used entries"""
+    size = len(result['diff_html'])
+    if size > DIFF_CACHE_MAX_CHARS:
+        return
+    with _diff_cache_lock:
+        replaced = _diff_cache.pop(key, None)
+        if replaced is not None:
+            _diff_cache_chars[0] -= len(replaced['diff_html'])
+        _diff_cache[key] = result
+        _diff_cache_chars[0] += size
+        while len(_diff_cache) > DIFF_CACHE_SIZE or _diff_cache_chars[0] > DIFF_CACHE_MAX_CHARS:
+            _, evicted = _diff_cache.popitem(last=False)
+            _diff_cache_chars[0] -= len(evicted['diff_html'])
+
+def comparison_entry(comp_filename, diff_result):
+    """Convert a DiffGenerator result into the stored per-file result"""
+    return {
+        'filename': comp_filename,
+        'has_differences': diff_result['has_differences'],
+        'change_count': diff_result['change_count'],
+        'diff_html': diff_result['html'],
+        'stats': diff_result['stats']
+    }
+
+def revalidated_response(response, etag):
+    """Mark a page as cacheable but always revalidated against its ETag"""
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.before_request
 def before_request():
-    """Run cleanup before each request"""
+    """Run session cleanup, throttled to once per CLEANUP_INTERVAL"""
+    now = time.monotonic()
+    if now - _last_cleanup[0] < CLEANUP_INTERVAL:
+        return
+    _last_cleanup[0] = now
     cleanup_old_sessions()
 
 @app.route('/')
 def index():
     """Main upload page"""
-    return render_template('index.html')
+    response = make_response(render_template('index.html'))
+    etag = hashlib.blake2b(response.get_data(), digest_size=8).hexdigest()
+    return revalidated_response(response, etag)
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
@@ -102,13 +345,17 @@ def upload_files():
             return redirect(url_for('index'))
         
         source_file = request.files['source_file']
-        comparison_files = request.files.getlist('comparison_files')
+        # Skip empty file inputs and sanitize each filename once
+        comparison_files = [
+            (secure_filename(f.filename), f)
+            for f in request.files.getlist('comparison_files') if f.filename
+        ]
         
         if source_file.filename == '':
             flash('Source/Reference file is required', 'error')
             return redirect(url_for('index'))
         
-        if not comparison_files or all(f.filename == '' for f in comparison_files):
+        if not comparison_files:
             flash('At least one comparison file is required', 'error')
             return redirect(url_for('index'))
         
@@ -122,7 +369,7 @@ def upload_files():
         # Save and validate source file
         source_filename = secure_filename(source_file.filename)
         source_path = session_dir / f"source_{source_filename}"
-        source_file.save(source_path)
+        save_upload(source_file, source_path)
         
         is_valid, error_msg = validate_rtf_file(source_path)
         if not is_valid:
@@ -131,13 +378,9 @@ def upload_files():
         
         # Save and validate comparison files
         comparison_paths = []
-        for comp_file in comparison_files:
-            if comp_file.filename == '':
-                continue
-                
-            comp_filename = secure_filename(comp_file.filename)
+        for comp_filename, comp_file in comparison_files:
             comp_path = session_dir / f"comp_{comp_filename}"
-            comp_file.save(comp_path)
+            save_upload(comp_file, comp_path)
             
             is_valid, error_msg = validate_rtf_file(comp_path)
             if not is_valid:
@@ -146,44 +389,57 @@ def upload_files():
             
             comparison_paths.append((comp_filename, comp_path))
         
-        if not comparison_paths:
-            flash('No valid comparison files found', 'error')
-            return redirect(url_for('index'))
-        
-        # Process comparisons
+        # Reuse cached results; only comparisons that miss are processed
+        source_digest = file_digest(source_path)
+        options_key = tuple(sorted(options.items()))
         results = []
-        source_text = rtf_processor.process_file(source_path, options)
-        
+        pending = []
         for comp_filename, comp_path in comparison_paths:
-            comp_text = rtf_processor.process_file(comp_path, options)
+            comp_digest = file_digest(comp_path)
+            if comp_digest == source_digest:
+                # Byte-identical files cannot differ after processing
+                results.append(comparison_entry(
+                    comp_filename,
+                    diff_generator.identical_result(source_filename, comp_filename)
+                ))
+                continue
             
-            diff_result = diff_generator.compare_texts(
-                source_text, comp_text, 
-                source_filename, comp_filename,
+            cache_key = (source_digest, comp_digest,
+                         source_filename, comp_filename, options_key)
+            cached = get_cached_diff(cache_key)
+            if cached is None:
+                pending.append((len(results), cache_key, comp_filename, comp_path))
+            results.append(cached)
+        
+        # Process comparisons
+        if pending:
+            diff_results = batch_compare(
+                source_path, source_filename,
+                [(comp_filename, comp_path) for _, _, comp_filename, comp_path in pending],
                 options
             )
-            
-            results.append({
-                'filename': comp_filename,
-                'has_differences': diff_result['has_differences'],
-                'change_count': diff_result['change_count'],
-                'diff_html': diff_result['html'],
-                'stats': diff_result['stats']
-            })
+            for (index, cache_key, comp_filename, _), diff_result in zip(pending, diff_results):
+                results[index] = comparison_entry(comp_filename, diff_result)
+                store_cached_diff(cache_key, results[index])
         
-        # Store results in session for later retrieval
-        session['comparison_results'] = {
+        # Store results server-side; the session only keeps their path
+        data = {
             'source_filename': source_filename,
             'results': results,
             'options': options,
             'timestamp': datetime.now().isoformat()
         }
+        write_report_files(session_dir, data)
+        save_results(data)
         
         return redirect(url_for('results'))
         
     except RequestEntityTooLarge:
         flash('File too large. Maximum size is 15MB per file.', 'error')
         return redirect(url_for('index'))
+    except TimeoutError:
+        flash('Comparison timed out. Try fewer or smaller files.', 'error')
+        return redirect(url_for('index'))
     except Exception as e:
         flash(f'Error processing files: {str(e)}', 'error')
         return redirect(url_for('index'))
@@ -191,24 +447,32 @@ def upload_files():
 @app.route('/results')
 def results():
     """Display comparison results"""
-    if 'comparison_results' not in session:
+    # The ETag changes with every upload, so a matching revalidation can skip
+    # loading and rendering the results (unless flash messages are pending)
+    etag = session.get('results_etag')
+    if (etag and etag in request.if_none_match and '_flashes' not in session
+            and os.path.isfile(session.get('results_path', ''))):
+        return revalidated_response(Response(status=304), etag)
+    
+    data = load_results()
+    if data is None:
         flash('No comparison results found. Please upload files first.', 'error')
         return redirect(url_for('index'))
     
-    data = session['comparison_results']
-    return render_template('results.html', 
+    response = make_response(render_template('results.html', 
                          source_filename=data['source_filename'],
                          results=data['results'],
-                         options=data['options'])
+                         options=data['options']))
+    return revalidated_response(response, etag)
 
 @app.route('/diff/<int:file_index>')
 def view_diff(file_index):
     """View individual file diff"""
-    if 'comparison_results' not in session:
+    data = load_results()
+    if data is None:
         flash('No comparison results found. Please upload files first.', 'error')
         return redirect(url_for('index'))
     
-    data = session['comparison_results']
     if file_index >= len(data['results']):
         flash('Invalid file index', 'error')
         return redirect(url_for('results'))
@@ -219,79 +483,59 @@ def view_diff(file_index):
                          comparison_filename=result['filename'],
                          diff_html=result['diff_html'],
                          stats=result['stats'],
-                         file_index=file_index)
+                         file_index=file_index,
+                         result_count=len(data['results']))
 
 @app.route('/download/report')
 def download_report():
     """Download consolidated HTML report"""
-    if 'comparison_results' not in session:
+    data = load_results()
+    if data is None:
         flash('No comparison results found. Please upload files first.', 'error')
         return redirect(url_for('index'))
     
-    data = session['comparison_results']
-    
-    # Generate consolidated report
-    report_html = diff_generator.generate_consolidated_report(
-        data['source_filename'],
-        data['results'],
-        data['options']
-    )
-    
-    # Create file-like object
-    report_file = io.BytesIO()
-    report_file.write(report_html.encode('utf-8'))
-    report_file.seek(0)
-    
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"rtf_comparison_report_{timestamp}.html"
     
-    return send_file(report_file, 
+    # Stream the report when the pre-rendered file is unavailable
+    if not os.path.isfile(data.get('report_path', '')):
+        report = diff_generator.iter_consolidated_report(
+            data['source_filename'],
+            data['results'],
+            data['options']
+        )
+        return Response(report,
+                        mimetype='text/html',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    
+    return send_file(data['report_path'],
                     as_attachment=True,
                     download_name=filename,
-                    mimetype='text/html')
+                    mimetype='text/html',
+                    conditional=True)
 
 @app.route('/download/csv')
 def download_csv():
     """Download summary as CSV"""
-    if 'comparison_results' not in session:
+    data = load_results()
+    if data is None:
         flash('No comparison results found. Please upload files first.', 'error')
         return redirect(url_for('index'))
     
-    data = session['comparison_results']
-    
-    # Create CSV content
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Header
-    writer.writerow(['Source File', 'Comparison File', 'Has Differences', 
-                    'Total Changes', 'Insertions', 'Deletions', 'Timestamp'])
-    
-    # Data rows
-    for result in data['results']:
-        writer.writerow([
-            data['source_filename'],
-            result['filename'],
-            'Yes' if result['has_differences'] else 'No',
-            result['change_count'],
-            result['stats']['insertions'],
-            result['stats']['deletions'],
-            data['timestamp']
-        ])
-    
-    # Create file-like object
-    csv_content = output.getvalue()
-    csv_file = io.BytesIO()
-    csv_file.write(csv_content.encode('utf-8'))
-    csv_file.seek(0)
-    
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"rtf_comparison_summary_{timestamp}.csv"
     
-    return send_file(csv_file,
+    # Stream the rows when the pre-rendered summary is unavailable
+    if not os.path.isfile(data.get('csv_path', '')):
+        return Response(iter_summary_csv(data),
+                        mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    
+    return send_file(data['csv_path'],
                     as_attachment=True,
                     download_name=filename,
-                    mimetype='text/csv')
+                    mimetype='text/csv',
+                    conditional=True)
 
 @app.errorhandler(413)
 def too_large(e):
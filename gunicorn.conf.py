@@ -1,9 +1,17 @@
+import gc
+import os
+
 # Production Configuration for RTF Diff App
 
 # Gunicorn Configuration (gunicorn.conf.py)
 bind = "0.0.0.0:8000"
-workers = 4
-worker_class = "sync"
+# WEB_CONCURRENCY also sizes each worker's comparison pool (utils/batch_compare.py)
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+# Threaded workers keep serving other requests while one thread is blocked
+# on a slow upload or download; the process count stays at 4 because
+# diffing is CPU-bound and holds the GIL
+worker_class = "gthread"
+threads = 4
 worker_connections = 1000
 timeout = 300
 keepalive = 5
@@ -11,6 +19,12 @@ max_requests = 1000
 max_requests_jitter = 100
 preload_app = True
 
+def when_ready(server):
+    # With preload_app the app is loaded in the master. Freezing the GC keeps
+    # the workers' collector from dirtying those pages, so they stay shared
+    # copy-on-write across forks.
+    gc.freeze()
+
 # Logging
 accesslog = "-"
 errorlog = "-"
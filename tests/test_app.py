@@ -11,6 +11,7 @@ from io import BytesIO
 from app import app
 from utils.rtf_processor import RTFProcessor
 from utils.diff_generator import DiffGenerator
+from utils.batch_compare import batch_compare, compare_files
 
 class TestRTFComparisonApp:
     
@@ -72,6 +73,40 @@ class TestRTFComparisonApp:
         
         assert response.status_code == 302  # Redirect back to index
     
+    def test_upload_rtf_with_utf8_bom(self):
+        """Test that RTF files starting with a UTF-8 byte order mark are accepted"""
+        source_file = BytesIO(b'\xef\xbb\xbf{\\rtf1\\ansi Source text.}')
+        comp_file = BytesIO(b'\xef\xbb\xbf{\\rtf1\\ansi Changed text.}')
+        
+        response = self.client.post('/upload', data={
+            'source_file': (source_file, 'source.rtf'),
+            'comparison_files': [(comp_file, 'comp.rtf')],
+            'diff_granularity': 'word'
+        })
+        
+        assert response.status_code == 302
+        assert '/results' in response.location
+    
+    def test_upload_comparison_timeout(self, monkeypatch):
+        """Test that a comparison that times out fails the upload with a message"""
+        import app as app_module
+        
+        def timed_out(*args):
+            raise TimeoutError("Comparison did not finish within 300 seconds")
+        
+        monkeypatch.setattr(app_module, 'batch_compare', timed_out)
+        source_file, source_name = self.create_test_rtf("Source text.", "source.rtf")
+        comp_file, comp_name = self.create_test_rtf("Changed text.", "comp.rtf")
+        
+        response = self.client.post('/upload', data={
+            'source_file': (source_file, source_name),
+            'comparison_files': [(comp_file, comp_name)]
+        })
+        assert response.status_code == 302
+        
+        response = self.client.get('/')
+        assert b'Comparison timed out' in response.data
+    
     def test_successful_upload_and_comparison(self):
         """Test successful file upload and comparison"""
         # Create test RTF files
@@ -95,6 +130,130 @@ class TestRTFComparisonApp:
         assert response.status_code == 302  # Redirect to results
         assert '/results' in response.location
     
+    def test_results_stored_server_side(self):
+        """Test that comparison results are kept out of the session cookie"""
+        source_file, source_name = self.create_test_rtf("Source document text.", "source.rtf")
+        comp_file, comp_name = self.create_test_rtf("Changed document text.", "comp.rtf")
+        
+        with self.client.session_transaction() as sess:
+            sess['session_id'] = 'test_session'
+        
+        response = self.client.post('/upload', data={
+            'source_file': (source_file, source_name),
+            'comparison_files': [(comp_file, comp_name)],
+            'diff_granularity': 'word'
+        })
+        assert response.status_code == 302
+        
+        with self.client.session_transaction() as sess:
+            assert 'comparison_results' not in sess
+            assert Path(sess['results_path']).is_file()
+        
+        assert self.client.get('/results').status_code == 200
+        assert self.client.get('/diff/0').status_code == 200
+        assert self.client.get('/download/report').status_code == 200
+        assert self.client.get('/download/csv').status_code == 200
+    
+    def test_downloads_stream_without_prerendered_files(self):
+        """Test that the report and CSV summary are streamed when their files are missing"""
+        source_file, source_name = self.create_test_rtf("Source document text.", "source.rtf")
+        comp_file, comp_name = self.create_test_rtf("Changed document text.", "comp.rtf")
+        
+        with self.client.session_transaction() as sess:
+            sess['session_id'] = 'test_session'
+        
+        self.client.post('/upload', data={
+            'source_file': (source_file, source_name),
+            'comparison_files': [(comp_file, comp_name)],
+            'diff_granularity': 'word'
+        })
+        
+        with self.client.session_transaction() as sess:
+            (Path(sess['results_path']).parent / 'report.html').unlink()
+            (Path(sess['results_path']).parent / 'summary.csv').unlink()
+        
+        response = self.client.get('/download/report')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/html'
+        assert 'attachment' in response.headers['Content-Disposition']
+        assert b'<h1>RTF Comparison Report</h1>' in response.data
+        
+        response = self.client.get('/download/csv')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        lines = response.get_data(as_text=True).splitlines()
+        assert lines[0].startswith('Source File,Comparison File')
+        assert lines[1].startswith('source.rtf,comp.rtf')
+    
+    def test_rejected_uploads_leave_no_staged_files(self):
+        """Test that staged upload files are removed when an upload is rejected"""
+        upload_folder = app.config['UPLOAD_FOLDER']
+        app.config['UPLOAD_FOLDER'] = self.temp_dir
+        try:
+            # Invalid source file
+            response = self.client.post('/upload', data={
+                'source_file': (BytesIO(b"Not RTF content"), 'source.rtf'),
+                'comparison_files': [self.create_test_rtf("Comparison text.", "comp.rtf")]
+            })
+            assert response.status_code == 302
+            
+            # Too many comparison files
+            source_file, source_name = self.create_test_rtf("Source text.", "source.rtf")
+            response = self.client.post('/upload', data={
+                'source_file': (source_file, source_name),
+                'comparison_files': [
+                    self.create_test_rtf(f"Comparison {i}.", f"comp{i}.rtf") for i in range(21)
+                ]
+            })
+            assert response.status_code == 302
+        finally:
+            app.config['UPLOAD_FOLDER'] = upload_folder
+        
+        staged = list(Path(self.temp_dir).glob('rtf_session_*/stage_*'))
+        assert staged == []
+    
+    def test_save_upload_closes_staged_file(self, monkeypatch):
+        """Test that the staged file is closed before it is moved, as Windows requires"""
+        import app as app_module
+        from werkzeug.datastructures import FileStorage
+        
+        stream = tempfile.NamedTemporaryFile('w+b', dir=self.temp_dir, delete=False)
+        stream.write(b"{\\rtf1 staged}")
+        dest = Path(self.temp_dir) / 'dest.rtf'
+        replace = os.replace
+        
+        def checked_replace(src, dst):
+            assert stream.closed
+            replace(src, dst)
+        
+        monkeypatch.setattr(os, 'replace', checked_replace)
+        app_module.save_upload(FileStorage(stream=stream), dest)
+        
+        assert dest.read_bytes() == b"{\\rtf1 staged}"
+        assert not Path(stream.name).exists()
+    
+    def test_conditional_get(self):
+        """Test that the index and results pages honour If-None-Match"""
+        response = self.client.get('/')
+        assert response.headers['ETag']
+        response = self.client.get('/', headers={'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+        
+        source_file, source_name = self.create_test_rtf("Source document text.", "source.rtf")
+        comp_file, comp_name = self.create_test_rtf("Changed document text.", "comp.rtf")
+        self.client.post('/upload', data={
+            'source_file': (source_file, source_name),
+            'comparison_files': [(comp_file, comp_name)],
+            'diff_granularity': 'word'
+        })
+        
+        response = self.client.get('/results')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        response = self.client.get('/results', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+    
     def test_results_page_without_data(self):
         """Test accessing results page without comparison data"""
         response = self.client.get('/results')
@@ -180,8 +339,12 @@ class TestRTFComparisonApp:
         
         assert response.status_code == 302
     
-    def test_identical_files(self):
+    def test_identical_files(self, monkeypatch):
         """Test comparison of identical files"""
+        import app as app_module
+        
+        calls = []
+        monkeypatch.setattr(app_module, 'batch_compare', lambda *args: calls.append(args))
         content = "This is identical content in both files."
         
         source_file, source_name = self.create_test_rtf(content, "source.rtf")
@@ -198,6 +361,11 @@ class TestRTFComparisonApp:
         })
         
         assert response.status_code == 302
+        assert calls == []  # Byte-identical files skip processing entirely
+        
+        response = self.client.get('/diff/0')
+        assert response.status_code == 200
+        assert b'The files are identical.' in response.data
     
     def test_empty_files(self):
         """Test comparison of empty files"""
@@ -246,6 +414,101 @@ class TestRTFComparisonApp:
         })
         assert response.status_code == 302
 
+    def test_repeat_upload_uses_diff_cache(self, monkeypatch):
+        """Test that re-uploading the same files reuses the cached comparison"""
+        import app as app_module
+        
+        def upload():
+            source_file, source_name = self.create_test_rtf("Cached source text.", "source.rtf")
+            comp_file, comp_name = self.create_test_rtf("Cached comparison text.", "comp.rtf")
+            return self.client.post('/upload', data={
+                'source_file': (source_file, source_name),
+                'comparison_files': [(comp_file, comp_name)],
+                'diff_granularity': 'word'
+            })
+        
+        with self.client.session_transaction() as sess:
+            sess['session_id'] = 'test_session'
+        
+        app_module._diff_cache.clear()
+        assert upload().status_code == 302
+        assert len(app_module._diff_cache) == 1
+        
+        calls = []
+        monkeypatch.setattr(app_module, 'batch_compare', lambda *args: calls.append(args))
+        assert upload().status_code == 302
+        assert calls == []
+        assert len(app_module._diff_cache) == 1
+
+    def test_diff_cache_bounded_by_html_size(self, monkeypatch):
+        """Test that the diff cache evicts by total diff HTML size"""
+        from collections import OrderedDict
+        import app as app_module
+        
+        monkeypatch.setattr(app_module, '_diff_cache', OrderedDict())
+        monkeypatch.setattr(app_module, '_diff_cache_chars', [0])
+        monkeypatch.setattr(app_module, 'DIFF_CACHE_MAX_CHARS', 100)
+        
+        for key in ('a', 'b', 'c'):
+            app_module.store_cached_diff(key, {'diff_html': 'x' * 40})
+        app_module.store_cached_diff('huge', {'diff_html': 'x' * 101})
+        
+        assert list(app_module._diff_cache) == ['b', 'c']
+        assert app_module._diff_cache_chars[0] == 80
+        assert app_module.get_cached_diff('huge') is None
+    
+    def test_cleanup_old_sessions(self):
+        """Test that only expired session directories are removed"""
+        import time
+        import app as app_module
+        
+        for name in ('rtf_session_old', 'rtf_session_new', 'unrelated_old'):
+            os.mkdir(os.path.join(self.temp_dir, name))
+        expired = time.time() - 25 * 60 * 60
+        for name in ('rtf_session_old', 'unrelated_old'):
+            os.utime(os.path.join(self.temp_dir, name), (expired, expired))
+        
+        upload_folder = app.config['UPLOAD_FOLDER']
+        app.config['UPLOAD_FOLDER'] = self.temp_dir
+        try:
+            app_module.cleanup_old_sessions()
+        finally:
+            app.config['UPLOAD_FOLDER'] = upload_folder
+        
+        assert sorted(os.listdir(self.temp_dir)) == ['rtf_session_new', 'unrelated_old']
+
+    def test_private_dir(self):
+        """Test that cache directories are private and shared ones are refused"""
+        import stat
+        import app as app_module
+        
+        created = app_module.private_dir(Path(self.temp_dir) / 'created')
+        assert stat.S_IMODE(os.stat(created).st_mode) == 0o700
+        
+        readable = Path(self.temp_dir) / 'readable'
+        readable.mkdir()
+        os.chmod(readable, 0o755)
+        app_module.private_dir(readable)
+        assert stat.S_IMODE(os.stat(readable).st_mode) == 0o700
+        
+        shared = Path(self.temp_dir) / 'shared'
+        shared.mkdir()
+        os.chmod(shared, 0o777)
+        with pytest.raises(RuntimeError):
+            app_module.private_dir(shared)
+    
+    def test_private_dir_on_windows(self, monkeypatch):
+        """Test that Windows directories, which always report mode 0o777, are accepted"""
+        import app as app_module
+        
+        cache_dir = Path(self.temp_dir) / 'windows'
+        monkeypatch.setattr(os, 'name', 'nt')
+        monkeypatch.setattr(os, 'lstat', lambda path: os.stat_result((0o40777,) + (0,) * 9))
+        
+        assert app_module.private_dir(cache_dir) == cache_dir
+        monkeypatch.undo()
+        assert cache_dir.is_dir()
+
 class TestDiffGenerator:
     
     def setup_method(self):
@@ -286,6 +549,24 @@ class TestDiffGenerator:
         assert 'html' in result
         assert 'stats' in result
     
+    def test_line_level_diff_rows(self):
+        """Test that line-level diffs render one table row per changed line"""
+        source_text = "Line 1\nLine <2>\nLine 3"
+        comp_text = "Line 1\nLine 3\nLine 4"
+        
+        result = self.generator.compare_texts(
+            source_text, comp_text,
+            "source.rtf", "comp.rtf",
+            {'diff_granularity': 'line'}
+        )
+        
+        assert result['stats']['deletions'] == 1
+        assert result['stats']['insertions'] == 1
+        assert '<!DOCTYPE' not in result['html']
+        assert '<tr class="diff-deleted">\n<td class="line-number">2</td>' in result['html']
+        assert 'Line &lt;2&gt;' in result['html']
+        assert '<span class="word-added">Line 4</span>' in result['html']
+    
     def test_identical_texts(self):
         """Test diff of identical texts"""
         text = "This is identical text"
@@ -300,6 +581,29 @@ class TestDiffGenerator:
         assert result['has_differences'] == False
         assert result['change_count'] == 0
     
+    def test_source_parts_reused(self, monkeypatch):
+        """Test that a pre-split source is diffed without tokenizing it again"""
+        source_text = "Hello world this is a test"
+        options = {'diff_granularity': 'word'}
+        source_parts = self.generator.split_text(source_text, options)
+        
+        tokenized = []
+        original = self.generator._tokenize_for_diff
+        monkeypatch.setattr(self.generator, '_tokenize_for_diff',
+                            lambda text: tokenized.append(text) or original(text))
+        
+        for comp_text in ("Hello there world", "Goodbye world"):
+            result = self.generator.compare_texts(
+                source_text, comp_text, "source.rtf", "comp.rtf", options,
+                source_parts=source_parts
+            )
+            assert result['has_differences']
+            assert result == self.generator.compare_texts(
+                source_text, comp_text, "source.rtf", "comp.rtf", options
+            )
+        
+        assert tokenized.count(source_text) == 2
+    
     def test_consolidated_report_generation(self):
         """Test consolidated HTML report generation"""
         results = [
@@ -329,3 +633,100 @@ class TestDiffGenerator:
         assert 'test1.rtf' in report
         assert 'test2.rtf' in report
         assert 'DOCTYPE html' in report
+
+class TestBatchCompare:
+    
+    def setup_method(self):
+        """Set up test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def teardown_method(self):
+        """Clean up test fixtures"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def create_test_rtf(self, content, filename):
+        """Create a test RTF file on disk"""
+        file_path = Path(self.temp_dir) / filename
+        file_path.write_text(f"{{\\rtf1\\ansi {content}}}", encoding='utf-8')
+        return file_path
+    
+    def test_batch_matches_sequential(self, monkeypatch):
+        """Test that parallel batch results match one-by-one comparisons in order"""
+        import utils.batch_compare as batch_module
+        
+        # Use the pool even on a single-CPU host
+        monkeypatch.setattr(batch_module, 'MAX_BATCH_WORKERS', 2)
+        source_path = self.create_test_rtf("The source document text.", "source.rtf")
+        comparisons = [
+            (f"comp{i}.rtf", self.create_test_rtf(f"The changed document {i} text.", f"comp{i}.rtf"))
+            for i in range(3)
+        ]
+        options = {'diff_granularity': 'word', 'normalize_whitespace': True}
+        
+        results = batch_compare(source_path, "source.rtf", comparisons, options)
+        
+        expected = [
+            compare_files(source_path, "source.rtf", [(name, path)], options)[0]
+            for name, path in comparisons
+        ]
+        assert [r['stats'] for r in results] == [r['stats'] for r in expected]
+        assert [r['html'] for r in results] == [r['html'] for r in expected]
+    
+    def test_batch_recovers_from_broken_pool(self, monkeypatch):
+        """Test that a pool whose worker died is replaced instead of failing every batch"""
+        import signal
+        import utils.batch_compare as batch_module
+        
+        monkeypatch.setattr(batch_module, 'MAX_BATCH_WORKERS', 2)
+        monkeypatch.setattr(batch_module, '_executor', None)
+        source_path = self.create_test_rtf("The source document text.", "source.rtf")
+        comparisons = [
+            (f"comp{i}.rtf", self.create_test_rtf(f"The changed document {i} text.", f"comp{i}.rtf"))
+            for i in range(2)
+        ]
+        options = {'diff_granularity': 'word'}
+        
+        expected = batch_compare(source_path, "source.rtf", comparisons, options)
+        
+        # Kill the pool's workers, as the OOM killer would
+        broken = batch_module._executor
+        for process in list(broken._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        
+        results = batch_compare(source_path, "source.rtf", comparisons, options)
+        assert [r['stats'] for r in results] == [r['stats'] for r in expected]
+        assert batch_module._executor is not broken
+    
+    def test_batch_timeout_discards_pool(self, monkeypatch):
+        """Test that a batch that outlives the timeout fails and its workers are killed"""
+        import utils.batch_compare as batch_module
+        
+        monkeypatch.setattr(batch_module, 'MAX_BATCH_WORKERS', 2)
+        monkeypatch.setattr(batch_module, 'BATCH_TIMEOUT', 0)
+        monkeypatch.setattr(batch_module, '_executor', None)
+        source_path = self.create_test_rtf("The source document text.", "source.rtf")
+        comparisons = [
+            (f"comp{i}.rtf", self.create_test_rtf(f"The changed document {i} text.", f"comp{i}.rtf"))
+            for i in range(2)
+        ]
+        
+        executor = batch_module._get_executor()
+        processes = []
+        original_submit = executor.submit
+        
+        def submit(*args):
+            future = original_submit(*args)
+            processes.extend(executor._processes.values())
+            return future
+        
+        monkeypatch.setattr(executor, 'submit', submit)
+        with pytest.raises(TimeoutError):
+            batch_compare(source_path, "source.rtf", comparisons, {'diff_granularity': 'word'})
+        
+        assert batch_module._executor is None
+        assert processes
+        for process in processes:
+            process.join(5)
+            assert process.exitcode is not None
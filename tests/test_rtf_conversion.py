@@ -7,7 +7,7 @@ import tempfile
 import os
 from pathlib import Path
 
-from utils.rtf_processor import RTFProcessor
+from utils.rtf_processor import RTFProcessor, DEFAULT_BOILERPLATE_PATTERNS
 
 class TestRTFProcessor:
     
@@ -239,3 +239,93 @@ class TestRTFProcessor:
         # Should not contain boilerplate
         assert "Generated on:" not in result
         assert "Program [SC]:" not in result
+    
+    def test_process_file_follows_changes(self):
+        """Test that processed text reflects the current file and patterns"""
+        file_path = self.create_test_rtf("Original content")
+        options = {
+            'ignore_boilerplate': True,
+            'normalize_whitespace': True,
+            'ignore_case': False,
+            'ignore_punctuation': False
+        }
+        
+        assert "Original content" in self.processor.process_file(file_path, options)
+        
+        # Rewriting the file changes the result
+        os.remove(file_path)
+        file_path = self.create_test_rtf("Changed content")
+        assert "Changed content" in self.processor.process_file(file_path, options)
+        
+        # Changing the patterns applies to the next call
+        self.processor.add_boilerplate_pattern(r'Changed content')
+        assert "Changed content" not in self.processor.process_file(file_path, options)
+    
+    def test_declared_codepage_decoding(self):
+        """Test that non-UTF-8 bytes are decoded with the declared code page"""
+        file_path = Path(self.temp_dir) / "cp1252.rtf"
+        with open(file_path, 'wb') as f:
+            f.write(b"{\\rtf1\\ansi\\ansicpg1252 Caf\xe9 au lait}")
+        
+        options = {
+            'ignore_boilerplate': False,
+            'normalize_whitespace': True,
+            'ignore_case': False,
+            'ignore_punctuation': False
+        }
+        
+        result = self.processor.process_file(file_path, options)
+        assert "Caf\u00e9 au lait" in result
+    
+    def test_boilerplate_prefilter_matches_regex(self):
+        """Test that the prefilter and re2 remove exactly what the re regex alone removes"""
+        lines = [
+            "Plain content line",
+            "confidential draft",
+            "See Program [SC]: t_ae.sas",
+            "Report generated on 2024-01-15",
+            "Subject 1001 had 3 events",
+            "  -----  ",
+            "===",
+            "- bullet point",
+            "ſtudy: ABC",
+            "Study:\x1cABC",
+            "Study design overview",
+            "",
+        ]
+        
+        prefiltered = self.processor._remove_boilerplate(lines)
+        self.processor._boilerplate_triggers = None
+        self.processor._ascii_boilerplate_search = self.processor._boilerplate_re.search
+        assert prefiltered == self.processor._remove_boilerplate(lines)
+        assert prefiltered == [
+            "Plain content line",
+            "Subject 1001 had 3 events",
+            "- bullet point",
+            "Study design overview",
+            "",
+        ]
+    
+    def test_custom_patterns_are_per_instance(self):
+        """Test that custom patterns do not leak into other processors"""
+        self.processor.add_boilerplate_pattern(r'DRAFT')
+        other = RTFProcessor()
+        
+        assert self.processor._remove_boilerplate(["DRAFT"]) == []
+        assert other._remove_boilerplate(["DRAFT"]) == ["DRAFT"]
+        assert other.boilerplate_patterns == DEFAULT_BOILERPLATE_PATTERNS
+    
+    def test_rtf_to_text_matches_striprtf(self):
+        """Test that the run-based converter matches striprtf's output"""
+        from striprtf.striprtf import rtf_to_text as striprtf_to_text
+        from utils.rtf_processor import rtf_to_text
+        
+        rtf = (
+            "{\\rtf1\\ansi\\ansicpg1252{\\fonttbl{\\f0 Courier New;}}"
+            "{\\*\\generator Writer;}\\uc2 Caf\\'e9 \\u8212??dash\\par "
+            "\\trowd\\cellx2000 Subject 1001\\cell 12.5 (3%)\\cell\\row "
+            "\\u233xy skipped\\tab end\\~of\\{text\\}}"
+        )
+        
+        assert rtf_to_text(rtf) == striprtf_to_text(rtf)
+        assert "Café —dash\n" in rtf_to_text(rtf)
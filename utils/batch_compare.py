@@ -0,0 +1,140 @@
+"""
+Parallel batch comparison of RTF files across worker processes
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.rtf_processor import RTFProcessor
+from utils.diff_generator import DiffGenerator
+
+def default_batch_workers():
+    """
+    Share the CPUs between the web server's worker processes, each of which
+    has its own pool; RTF_BATCH_WORKERS overrides the pool size
+    """
+    if 'RTF_BATCH_WORKERS' in os.environ:
+        return max(1, int(os.environ['RTF_BATCH_WORKERS']))
+    web_workers = max(1, int(os.environ.get('WEB_CONCURRENCY', 4)))
+    return max(1, min(8, (os.cpu_count() or 1) // web_workers))
+
+# Processes used for batch comparisons in each web worker
+MAX_BATCH_WORKERS = default_batch_workers()
+# Seconds a request waits for the pool; gthread workers are not killed by
+# gunicorn's timeout (300) while a request thread blocks, so enforce it here
+BATCH_TIMEOUT = int(os.environ.get('RTF_BATCH_TIMEOUT', 300))
+
+# Module-level instances, created once per process (including pool workers)
+rtf_processor = RTFProcessor()
+diff_generator = DiffGenerator()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    """
+    Return this process's pool, creating it on first use. The pool is never
+    inherited across fork, and its workers start from a forkserver so a
+    threaded web worker is not forked mid-request.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _executor = ProcessPoolExecutor(
+                max_workers=MAX_BATCH_WORKERS,
+                mp_context=multiprocessing.get_context(method)
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+def _discard_executor(executor, terminate=False):
+    """
+    Drop a broken pool so the next batch starts a fresh one. With terminate,
+    also kill its workers, which may still be busy on a stuck comparison.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    if terminate:
+        # ProcessPoolExecutor has no public way to stop running tasks
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def compare_files(source_path, source_filename, comparisons, options):
+    """
+    Process comparison files and diff each against the source file. The
+    source is parsed and split once for the group, and the split is
+    released when the group is done.
+    """
+    source_text = rtf_processor.process_file(source_path, options)
+    source_parts = diff_generator.split_text(source_text, options)
+    results = []
+    for comp_filename, comp_path in comparisons:
+        comp_text = rtf_processor.process_file(comp_path, options)
+        results.append(diff_generator.compare_texts(
+            source_text, comp_text,
+            source_filename, comp_filename,
+            options,
+            source_parts=source_parts
+        ))
+    return results
+
+def batch_compare(source_path, source_filename, comparisons, options):
+    """
+    Compare several files against one source file
+
+    Args:
+        source_path: Path to the source RTF file
+        source_filename: Display name of the source file
+        comparisons: List of (comparison filename, path) pairs
+        options: Dict of processing and diff options
+
+    Returns:
+        List of DiffGenerator results, in the order of comparisons
+
+    Raises:
+        TimeoutError: if the pool takes longer than BATCH_TIMEOUT seconds
+    """
+    if len(comparisons) <= 1 or MAX_BATCH_WORKERS <= 1:
+        return compare_files(source_path, source_filename, comparisons, options)
+
+    # One task per worker, each splitting the source once for its group;
+    # round-robin groups spread consecutive (often similar-sized) files
+    group_count = min(MAX_BATCH_WORKERS, len(comparisons))
+    groups = [
+        [(comp_filename, str(comp_path)) for comp_filename, comp_path in comparisons[k::group_count]]
+        for k in range(group_count)
+    ]
+
+    deadline = time.monotonic() + BATCH_TIMEOUT
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            futures = [
+                executor.submit(compare_files, str(source_path), source_filename, group, options)
+                for group in groups
+            ]
+            group_results = [
+                future.result(timeout=max(0, deadline - time.monotonic()))
+                for future in futures
+            ]
+            return [
+                group_results[index % group_count][index // group_count]
+                for index in range(len(comparisons))
+            ]
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); retry once on a new pool
+            _discard_executor(executor)
+            if attempt:
+                raise
+        except FuturesTimeoutError:
+            _discard_executor(executor, terminate=True)
+            raise TimeoutError(f"Comparison did not finish within {BATCH_TIMEOUT} seconds")
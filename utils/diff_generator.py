@@ -2,14 +2,60 @@
 Diff generation utilities for text comparison and HTML report creation
 """
 
-import difflib
+import html
 import re
 from datetime import datetime
 
-class DiffGenerator:
-    def __init__(self):
-        """Initialize diff generator with styling"""
-        self.css_styles = """
+try:
+    # Optional C implementation with the same matching algorithm and opcodes
+    from cdifflib import CSequenceMatcher as SequenceMatcher
+except ImportError:
+    from difflib import SequenceMatcher
+
+# Word tokens are runs of str.isalnum() characters (\w without '_');
+# anything else is a single-character token
+_TOKEN_RE = re.compile(r'[^\W_]+|.', re.DOTALL)
+# Whitespace other than '\n' and ' ', folded to ' ' before tokenizing
+_OTHER_WHITESPACE_RE = re.compile(r'[^\S\n ]')
+
+# Row templates for the word-level diff table, filled positionally with %
+# (faster than str.format or string.Template); cells are pre-escaped
+# (line_num, cell, cell)
+_CONTEXT_ROW = (
+    '<tr class="context-line">\n'
+    '<td class="line-number">%d</td>\n'
+    '<td class="diff-unchanged">%s</td>\n'
+    '<td class="diff-unchanged">%s</td>\n'
+    '</tr>'
+)
+# (line_num, source)
+_DELETED_ROW = (
+    '<tr class="diff-deleted">\n'
+    '<td class="line-number">%d</td>\n'
+    '<td><span class="word-deleted">%s</span></td>\n'
+    '<td></td>\n'
+    '</tr>'
+)
+# (line_num, comparison)
+_INSERTED_ROW = (
+    '<tr class="diff-added">\n'
+    '<td class="line-number">%d</td>\n'
+    '<td></td>\n'
+    '<td><span class="word-added">%s</span></td>\n'
+    '</tr>'
+)
+# (line_num, source, comparison)
+_CHANGED_ROW = (
+    '<tr class="diff-changed">\n'
+    '<td class="line-number">%d</td>\n'
+    '<td><span class="word-deleted">%s</span></td>\n'
+    '<td><span class="word-added">%s</span></td>\n'
+    '</tr>'
+)
+_ELIDED_ROW = '<tr><td colspan="3" style="text-align: center; color: #666;">... (identical content) ...</td></tr>'
+
+# Stylesheet embedded in every diff and report, shared by all generators
+CSS_STYLES = """
         <style>
         .diff-container { font-family: 'Courier New', monospace; font-size: 14px; }
         .diff-table { width: 100%; border-collapse: collapse; margin: 20px 0; }
@@ -34,8 +80,14 @@ class DiffGenerator:
         .context-line { background-color: #f8f9fa; }
         </style>
         """
+
+class DiffGenerator:
+    def __init__(self):
+        """Initialize diff generator with styling"""
+        self.css_styles = CSS_STYLES
     
-    def compare_texts(self, source_text, comparison_text, source_filename, comparison_filename, options):
+    def compare_texts(self, source_text, comparison_text, source_filename, comparison_filename, options,
+                      source_parts=None):
         """
         Compare two texts and generate diff results
         
@@ -45,35 +97,71 @@ class DiffGenerator:
             source_filename: Name of source file
             comparison_filename: Name of comparison file
             options: Comparison options
+            source_parts: Optional split_text(source_text, options), for
+                callers comparing several texts against one source
             
         Returns:
             Dict with comparison results
         """
+        if source_parts is None:
+            source_parts = self.split_text(source_text, options)
         if options.get('diff_granularity') == 'word':
-            return self._word_level_diff(source_text, comparison_text, source_filename, comparison_filename, options)
+            return self._word_level_diff(source_parts, comparison_text, source_filename, comparison_filename, options)
         else:
-            return self._line_level_diff(source_text, comparison_text, source_filename, comparison_filename, options)
+            return self._line_level_diff(source_parts, comparison_text, source_filename, comparison_filename, options)
+    
+    def split_text(self, text, options):
+        """Split text into the units diffed at the chosen granularity"""
+        if options.get('diff_granularity') == 'word':
+            return self._tokenize_for_diff(text)
+        return text.splitlines()
+    
+    def identical_result(self, source_filename, comparison_filename):
+        """Build the result for byte-identical files without parsing or diffing them"""
+        stats = {
+            'insertions': 0,
+            'deletions': 0,
+            'replacements': 0,
+            'total_changes': 0
+        }
+        
+        html_parts = [
+            self.css_styles,
+            '<div class="diff-container">',
+            '<div class="file-header">',
+            f'<h2>Comparison: {comparison_filename} vs {source_filename}</h2>',
+            '</div>',
+            '<div class="summary-box">',
+            '<h3>Summary</h3>',
+            '<p>The files are identical.</p>',
+            '</div>',
+            '</div>'
+        ]
+        
+        return {
+            'has_differences': False,
+            'change_count': 0,
+            'html': '\n'.join(html_parts),
+            'stats': stats
+        }
     
-    def _word_level_diff(self, source_text, comparison_text, source_filename, comparison_filename, options):
+    def _word_level_diff(self, source_words, comparison_text, source_filename, comparison_filename, options):
         """Generate word-level diff"""
-        source_words = self._tokenize_for_diff(source_text)
         comparison_words = self._tokenize_for_diff(comparison_text)
         
         # Generate sequence matcher
-        matcher = difflib.SequenceMatcher(None, source_words, comparison_words)
-        
-        # Build diff HTML
-        html_parts = [self.css_styles]
-        html_parts.append(f'<div class="diff-container">')
-        html_parts.append(f'<div class="file-header">')
-        html_parts.append(f'<h2>Comparison: {comparison_filename} vs {source_filename}</h2>')
-        html_parts.append(f'</div>')
+        matcher = SequenceMatcher(None, source_words, comparison_words)
         
         # Statistics
         opcodes = matcher.get_opcodes()
-        insertions = sum(1 for tag, _, _, _, _ in opcodes if tag == 'insert')
-        deletions = sum(1 for tag, _, _, _, _ in opcodes if tag == 'delete')
-        replacements = sum(1 for tag, _, _, _, _ in opcodes if tag == 'replace')
+        insertions = deletions = replacements = 0
+        for tag, _, _, _, _ in opcodes:
+            if tag == 'insert':
+                insertions += 1
+            elif tag == 'delete':
+                deletions += 1
+            elif tag == 'replace':
+                replacements += 1
         
         stats = {
             'insertions': insertions,
@@ -82,118 +170,78 @@ class DiffGenerator:
             'total_changes': insertions + deletions + replacements
         }
         
-        html_parts.append(f'<div class="summary-box">')
-        html_parts.append(f'<h3>Summary</h3>')
-        html_parts.append(f'<div class="stats">')
-        html_parts.append(f'<div class="stat-item stat-added">Insertions: {insertions}</div>')
-        html_parts.append(f'<div class="stat-item stat-deleted">Deletions: {deletions}</div>')
-        html_parts.append(f'<div class="stat-item stat-unchanged">Replacements: {replacements}</div>')
-        html_parts.append(f'</div>')
-        html_parts.append(f'</div>')
-        
-        # Legend
-        html_parts.append('<div class="legend">')
-        html_parts.append('<strong>Legend:</strong> ')
-        html_parts.append('<span class="legend-item"><span class="word-added">Added</span></span>')
-        html_parts.append('<span class="legend-item"><span class="word-deleted">Deleted</span></span>')
-        html_parts.append('<span class="legend-item"><span class="diff-unchanged">Unchanged</span></span>')
-        html_parts.append('</div>')
-        
-        # Diff table
-        html_parts.append('<table class="diff-table">')
-        html_parts.append('<thead><tr><th width="50">Line</th><th width="50%">Source</th><th width="50%">Comparison</th></tr></thead>')
-        html_parts.append('<tbody>')
-        
+        # Diff table rows
+        rows = []
         source_line_num = 1
         comp_line_num = 1
         
         for tag, i1, i2, j1, j2 in opcodes:
             if tag == 'equal':
                 # Show a few context lines for equal sections
-                equal_text = ' '.join(source_words[i1:i2])
-                lines = equal_text.split('\n')
-                for line in lines[:3]:  # Show first 3 lines of context
+                head_lines, tail_lines, line_count = self._context_lines(source_words, i1, i2)
+                for line in head_lines:  # Show first 3 lines of context
                     if line.strip():
-                        html_parts.append(f'<tr class="context-line">')
-                        html_parts.append(f'<td class="line-number">{source_line_num}</td>')
-                        html_parts.append(f'<td class="diff-unchanged">{self._escape_html(line[:100])}{"..." if len(line) > 100 else ""}</td>')
-                        html_parts.append(f'<td class="diff-unchanged">{self._escape_html(line[:100])}{"..." if len(line) > 100 else ""}</td>')
-                        html_parts.append('</tr>')
+                        rows.append(self._context_row(source_line_num, line))
                         source_line_num += 1
                         comp_line_num += 1
-                if len(lines) > 6:
-                    html_parts.append('<tr><td colspan="3" style="text-align: center; color: #666;">... (identical content) ...</td></tr>')
-                for line in lines[-3:]:  # Show last 3 lines of context
-                    if line.strip() and len(lines) > 3:
-                        html_parts.append(f'<tr class="context-line">')
-                        html_parts.append(f'<td class="line-number">{source_line_num}</td>')
-                        html_parts.append(f'<td class="diff-unchanged">{self._escape_html(line[:100])}{"..." if len(line) > 100 else ""}</td>')
-                        html_parts.append(f'<td class="diff-unchanged">{self._escape_html(line[:100])}{"..." if len(line) > 100 else ""}</td>')
-                        html_parts.append('</tr>')
+                if line_count > 6:
+                    rows.append(_ELIDED_ROW)
+                for line in tail_lines:  # Show last 3 lines of context
+                    if line.strip() and line_count > 3:
+                        rows.append(self._context_row(source_line_num, line))
                         source_line_num += 1
                         comp_line_num += 1
             
             elif tag == 'delete':
                 deleted_text = ' '.join(source_words[i1:i2])
-                html_parts.append('<tr class="diff-deleted">')
-                html_parts.append(f'<td class="line-number">{source_line_num}</td>')
-                html_parts.append(f'<td><span class="word-deleted">{self._escape_html(deleted_text)}</span></td>')
-                html_parts.append('<td></td>')
-                html_parts.append('</tr>')
+                rows.append(_DELETED_ROW % (
+                    source_line_num,
+                    self._escape_html(deleted_text)
+                ))
                 source_line_num += deleted_text.count('\n') + 1
             
             elif tag == 'insert':
                 inserted_text = ' '.join(comparison_words[j1:j2])
-                html_parts.append('<tr class="diff-added">')
-                html_parts.append(f'<td class="line-number">{comp_line_num}</td>')
-                html_parts.append('<td></td>')
-                html_parts.append(f'<td><span class="word-added">{self._escape_html(inserted_text)}</span></td>')
-                html_parts.append('</tr>')
+                rows.append(_INSERTED_ROW % (
+                    comp_line_num,
+                    self._escape_html(inserted_text)
+                ))
                 comp_line_num += inserted_text.count('\n') + 1
             
             elif tag == 'replace':
                 source_text_part = ' '.join(source_words[i1:i2])
                 comp_text_part = ' '.join(comparison_words[j1:j2])
-                html_parts.append('<tr class="diff-changed">')
-                html_parts.append(f'<td class="line-number">{source_line_num}</td>')
-                html_parts.append(f'<td><span class="word-deleted">{self._escape_html(source_text_part)}</span></td>')
-                html_parts.append(f'<td><span class="word-added">{self._escape_html(comp_text_part)}</span></td>')
-                html_parts.append('</tr>')
+                rows.append(_CHANGED_ROW % (
+                    source_line_num,
+                    self._escape_html(source_text_part),
+                    self._escape_html(comp_text_part)
+                ))
                 source_line_num += source_text_part.count('\n') + 1
                 comp_line_num += comp_text_part.count('\n') + 1
         
-        html_parts.append('</tbody></table>')
-        html_parts.append('</div>')
-        
-        html_content = '\n'.join(html_parts)
-        
         return {
             'has_differences': stats['total_changes'] > 0,
             'change_count': stats['total_changes'],
-            'html': html_content,
+            'html': self._diff_html(source_filename, comparison_filename, stats, rows),
             'stats': stats
         }
     
-    def _line_level_diff(self, source_text, comparison_text, source_filename, comparison_filename, options):
+    def _line_level_diff(self, source_lines, comparison_text, source_filename, comparison_filename, options):
         """Generate line-level diff"""
-        source_lines = source_text.splitlines()
         comparison_lines = comparison_text.splitlines()
         
-        # Generate HTML diff
-        differ = difflib.HtmlDiff(wrapcolumn=80)
-        html_diff = differ.make_file(
-            source_lines, comparison_lines,
-            fromdesc=f"{source_filename} (Source)",
-            todesc=f"{comparison_filename} (Comparison)"
-        )
-        
-        # Count changes
-        matcher = difflib.SequenceMatcher(None, source_lines, comparison_lines)
+        # One matcher drives both the counts and the rendered rows
+        matcher = SequenceMatcher(None, source_lines, comparison_lines)
         opcodes = matcher.get_opcodes()
         
-        insertions = sum(j2 - j1 for tag, _, _, j1, j2 in opcodes if tag == 'insert')
-        deletions = sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == 'delete')
-        replacements = sum(max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in opcodes if tag == 'replace')
+        insertions = deletions = replacements = 0
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'insert':
+                insertions += j2 - j1
+            elif tag == 'delete':
+                deletions += i2 - i1
+            elif tag == 'replace':
+                replacements += max(i2 - i1, j2 - j1)
         
         stats = {
             'insertions': insertions,
@@ -202,48 +250,138 @@ class DiffGenerator:
             'total_changes': insertions + deletions + replacements
         }
         
+        # Diff table rows, numbered by source line (comparison line for insertions)
+        escape = self._escape_html
+        rows = []
+        
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                # Show the first and last 3 lines of longer equal sections
+                if i2 - i1 > 6:
+                    shown = [*range(i1, i1 + 3), None, *range(i2 - 3, i2)]
+                else:
+                    shown = range(i1, i2)
+                for i in shown:
+                    if i is None:
+                        rows.append(_ELIDED_ROW)
+                    else:
+                        rows.append(self._context_row(i + 1, source_lines[i]))
+            
+            elif tag == 'delete':
+                for i in range(i1, i2):
+                    rows.append(_DELETED_ROW % (i + 1, escape(source_lines[i])))
+            
+            elif tag == 'insert':
+                for j in range(j1, j2):
+                    rows.append(_INSERTED_ROW % (j + 1, escape(comparison_lines[j])))
+            
+            elif tag == 'replace':
+                # Pair changed lines up; the longer side's extra lines stand alone
+                for k in range(max(i2 - i1, j2 - j1)):
+                    i, j = i1 + k, j1 + k
+                    if i < i2 and j < j2:
+                        rows.append(_CHANGED_ROW % (
+                            i + 1, escape(source_lines[i]), escape(comparison_lines[j])
+                        ))
+                    elif i < i2:
+                        rows.append(_DELETED_ROW % (i + 1, escape(source_lines[i])))
+                    else:
+                        rows.append(_INSERTED_ROW % (j + 1, escape(comparison_lines[j])))
+        
         return {
             'has_differences': stats['total_changes'] > 0,
             'change_count': stats['total_changes'],
-            'html': html_diff,
+            'html': self._diff_html(source_filename, comparison_filename, stats, rows),
             'stats': stats
         }
     
-    def _tokenize_for_diff(self, text):
-        """Tokenize text for word-level diffing"""
-        # Split on whitespace and punctuation but keep structure
-        words = []
-        current_word = ""
+    def _diff_html(self, source_filename, comparison_filename, stats, rows):
+        """Wrap rendered diff table rows with the header, summary and legend"""
+        html_parts = [self.css_styles]
+        html_parts.append(f'<div class="diff-container">')
+        html_parts.append(f'<div class="file-header">')
+        html_parts.append(f'<h2>Comparison: {comparison_filename} vs {source_filename}</h2>')
+        html_parts.append(f'</div>')
+        
+        # Statistics
+        html_parts.append(f'<div class="summary-box">')
+        html_parts.append(f'<h3>Summary</h3>')
+        html_parts.append(f'<div class="stats">')
+        html_parts.append(f'<div class="stat-item stat-added">Insertions: {stats["insertions"]}</div>')
+        html_parts.append(f'<div class="stat-item stat-deleted">Deletions: {stats["deletions"]}</div>')
+        html_parts.append(f'<div class="stat-item stat-unchanged">Replacements: {stats["replacements"]}</div>')
+        html_parts.append(f'</div>')
+        html_parts.append(f'</div>')
+        
+        # Legend
+        html_parts.append('<div class="legend">')
+        html_parts.append('<strong>Legend:</strong> ')
+        html_parts.append('<span class="legend-item"><span class="word-added">Added</span></span>')
+        html_parts.append('<span class="legend-item"><span class="word-deleted">Deleted</span></span>')
+        html_parts.append('<span class="legend-item"><span class="diff-unchanged">Unchanged</span></span>')
+        html_parts.append('</div>')
         
-        for char in text:
-            if char.isalnum():
-                current_word += char
-            else:
-                if current_word:
-                    words.append(current_word)
-                    current_word = ""
-                if char.strip():  # Non-whitespace punctuation
-                    words.append(char)
-                elif char in '\n\r':
-                    words.append('\n')
-                elif char.isspace():
-                    words.append(' ')
+        # Diff table
+        html_parts.append('<table class="diff-table">')
+        html_parts.append('<thead><tr><th width="50">Line</th><th width="50%">Source</th><th width="50%">Comparison</th></tr></thead>')
+        html_parts.append('<tbody>')
+        html_parts.extend(rows)
+        html_parts.append('</tbody></table>')
+        html_parts.append('</div>')
         
-        if current_word:
-            words.append(current_word)
+        return '\n'.join(html_parts)
+    
+    def _tokenize_for_diff(self, text):
+        """Tokenize text for word-level diffing"""
+        # Runs of alphanumerics are words; every other character is its own
+        # token, with line breaks folded to '\n' and other whitespace to ' '
+        text = _OTHER_WHITESPACE_RE.sub(' ', text.replace('\r', '\n'))
+        return _TOKEN_RE.findall(text)
+    
+    def _context_lines(self, words, i1, i2):
+        """
+        Return the first 3 and last 3 lines of ' '.join(words[i1:i2]) and its
+        line count, joining only the words around those lines
+        """
+        block = words[i1:i2]
+        line_count = block.count('\n') + 1
+        if line_count <= 6:
+            lines = ' '.join(block).split('\n')
+            return lines[:3], lines[-3:], line_count
         
-        return words
+        head_end = self._third_line_break(block)
+        tail_start = len(block) - 1 - self._third_line_break(block[::-1])
+        head_lines = ' '.join(block[:head_end + 1]).split('\n')[:3]
+        tail_lines = ' '.join(block[tail_start:]).split('\n')[-3:]
+        return head_lines, tail_lines, line_count
+    
+    def _third_line_break(self, words):
+        """Index of the third '\n' token in words"""
+        index = -1
+        for _ in range(3):
+            index = words.index('\n', index + 1)
+        return index
+    
+    def _context_row(self, line_num, line):
+        """Render an unchanged line, truncated to 100 characters, in both columns"""
+        cell = self._escape_html(line[:100])
+        if len(line) > 100:
+            cell += '...'
+        return _CONTEXT_ROW % (line_num, cell, cell)
     
     def _escape_html(self, text):
         """Escape HTML characters"""
-        return (text.replace('&', '&amp;')
-                   .replace('<', '&lt;')
-                   .replace('>', '&gt;')
-                   .replace('"', '&quot;')
-                   .replace("'", '&#x27;'))
+        return html.escape(text, quote=True)
     
     def generate_consolidated_report(self, source_filename, results, options):
         """Generate consolidated HTML report for all comparisons"""
+        return ''.join(self.iter_consolidated_report(source_filename, results, options))
+    
+    def iter_consolidated_report(self, source_filename, results, options):
+        """
+        Yield the consolidated report in chunks, so callers writing it to a
+        file never hold every diff joined into one string
+        """
         html_parts = [
             '<!DOCTYPE html>',
             '<html lang="en">',
@@ -286,19 +424,13 @@ class DiffGenerator:
             '</div>',
             '<h2>Detailed Comparisons</h2>'
         ])
+        yield '\n'.join(html_parts)
         
-        # Individual diffs
+        # Individual diffs are yielded as-is rather than copied into the report
         for i, result in enumerate(results):
             if result['has_differences']:
-                html_parts.append(f'<div id="diff-{i}">')
-                html_parts.append(result['diff_html'])
-                html_parts.append('</div>')
-                html_parts.append('<hr style="margin: 40px 0;">')
+                yield f'\n<div id="diff-{i}">\n'
+                yield result['diff_html']
+                yield '\n</div>\n<hr style="margin: 40px 0;">'
         
-        html_parts.extend([
-            '</div>',
-            '</body>',
-            '</html>'
-        ])
-        
-        return '\n'.join(html_parts)
+        yield '\n</div>\n</body>\n</html>'
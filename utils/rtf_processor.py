@@ -2,44 +2,233 @@
 RTF Processing utilities for text extraction and cleaning
 """
 
+import codecs
 import re
 import yaml
 from pathlib import Path
-from striprtf.striprtf import rtf_to_text
+from striprtf.striprtf import HYPERLINKS, destinations, specialchars
+
+try:
+    # Optional linear-time regex engine for the default boilerplate patterns
+    import re2
+except ImportError:
+    re2 = None
+
+# Default boilerplate patterns, shared read-only by all processors
+DEFAULT_BOILERPLATE_PATTERNS = (
+    # SAS system output headers/footers
+    r'Version \d+\.\d+ SAS System Output',
+    r'CONFIDENTIAL',
+    r'Program \[SC\]:.*',
+    r'Page \d+ of \d+',
+    r'Generated on:?\s*\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
+    r'Created on:?\s*\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
+    r'Updated on:?\s*\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
+    r'Printed on:?\s*\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
+    r'Generated at:?\s*\d{2}/\d{2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
+    r'Created at:?\s*\d{2}/\d{2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
+    r'Updated at:?\s*\d{2}/\d{2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
+    r'Printed at:?\s*\d{2}/\d{2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
+    r'\d{1,2}-[A-Za-z]{3}-\d{4}(\s+\d{2}:\d{2}:\d{2})?',
+    r'\d{1,2}/\d{1,2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
+    r'\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
+    # Table pagination and metadata
+    r'Table \d+\.\d+(\.\d+)?',
+    r'Listing \d+\.\d+(\.\d+)?',
+    r'Figure \d+\.\d+(\.\d+)?',
+    r'^\s*-+\s*$',  # Separator lines
+    r'^\s*=+\s*$',  # Separator lines
+    r'Study:\s*\w+',
+    r'Protocol:\s*\w+',
+    r'Output Date:.*',
+    r'Run Date:.*',
+    r'File Path:.*',
+    r'Program Name:.*',
+)
+
+# Lowercase literals that any digit-free match of the default patterns must
+# contain; other default patterns need a digit or a leading '-'/'=' separator
+_DEFAULT_BOILERPLATE_TRIGGERS = (
+    'confidential', 'program [sc]:', 'study:', 'protocol:',
+    'output date:', 'run date:', 'file path:', 'program name:',
+)
+_DIGIT_RE = re.compile(r'[0-9]')
+
+def _compile_default_boilerplate_re2():
+    """
+    Compile the default patterns with re2 for matching ASCII lines, or return
+    None. re2's \\s omits \\v and \\x1c-\\x1f, so it is spelled out to match re.
+    """
+    if re2 is None:
+        return None
+    options = re2.Options()
+    options.case_sensitive = False
+    pattern = '|'.join(f'(?:{pattern})' for pattern in DEFAULT_BOILERPLATE_PATTERNS)
+    return re2.compile(pattern.replace(r'\s', r'[\t-\r\x1c-\x1f ]'), options)
+
+_DEFAULT_BOILERPLATE_RE2 = _compile_default_boilerplate_re2()
+
+# Code page declaration in the RTF header, e.g. \ansicpg1252
+_ANSICPG_RE = re.compile(rb'\\ansicpg(\d+)')
+
+# Characters that are neither word characters nor whitespace
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+# Same deletion for pure-ASCII text as a str.translate table
+_ASCII_PUNCTUATION_TABLE = dict.fromkeys(
+    c for c in range(128) if _PUNCTUATION_RE.match(chr(c))
+)
+
+# Hex escapes (\'e9), control words with optional signed parameter, and braces
+_RTF_TOKEN_RE = re.compile(r"\\['\"]([0-9a-fA-F]{2})|\\[a-z]+-?\d*\s?|[{}]")
+
+def _replace_rtf_token(match):
+    """Decode a hex escape; drop control words and braces"""
+    hex_code = match.group(1)
+    return chr(int(hex_code, 16)) if hex_code else ''
+
+# _RTF_TEXT_PATTERN and rtf_to_text below are derived from striprtf 0.0.26
+# (https://github.com/joshy/striprtf), used under the BSD 3-Clause License:
+#
+# Copyright (c) 2018, Joshy Cyriac
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# striprtf's tokenizer with runs of plain characters matched as one token
+# instead of one match per character
+_RTF_TEXT_PATTERN = re.compile(
+    r"\\([a-z]{1,32})(-?\d{1,10})?[ ]?|\\'([0-9a-f]{2})|\\([^a-z])|([{}])|[\r\n]+"
+    r"|([^\\{}\r\n]+)|(.)",
+    re.IGNORECASE,
+)
+
+def rtf_to_text(text, encoding="cp1252", errors="strict"):
+    """
+    Convert RTF to plain text with the same output as striprtf.rtf_to_text,
+    handling each run of plain text in one step and joining output once
+    """
+    text = HYPERLINKS.sub("\\1(\\2)", text)
+    stack = []
+    ignorable = False  # Whether this group (and all inside it) are ignorable
+    ucskip = 1  # Number of ASCII characters to skip after a unicode character
+    curskip = 0  # Number of ASCII characters left to skip
+    hexes = None
+    out = []
+    
+    for match in _RTF_TEXT_PATTERN.finditer(text):
+        word, arg, _hex, char, brace, run, tchar = match.groups()
+        if hexes and not _hex:
+            out.append(bytes.fromhex(hexes).decode(encoding=encoding, errors=errors))
+            hexes = None
+        if run:
+            # Skipped characters after \u count against the run one by one
+            if curskip > 0:
+                skipped = min(curskip, len(run))
+                curskip -= skipped
+                run = run[skipped:]
+            if run and not ignorable:
+                out.append(run)
+        elif brace:
+            curskip = 0
+            if brace == "{":
+                stack.append((ucskip, ignorable))
+            elif stack:
+                ucskip, ignorable = stack.pop()
+            else:
+                # Unbalanced closing brace, handled as striprtf does
+                ucskip = 0
+                ignorable = True
+        elif char:  # \x (not a letter)
+            curskip = 0
+            if char in specialchars:
+                if not ignorable:
+                    out.append(specialchars[char])
+            elif char == "*":
+                ignorable = True
+        elif word:  # \foo
+            curskip = 0
+            if word in destinations:
+                ignorable = True
+            elif word == "ansicpg":
+                encoding = f"cp{arg}"
+                try:
+                    codecs.lookup(encoding)
+                except LookupError:
+                    encoding = "utf8"
+            if ignorable:
+                pass
+            elif word in specialchars:
+                out.append(specialchars[word])
+            elif word == "uc":
+                ucskip = int(arg)
+            elif word == "u":
+                if arg is None:
+                    curskip = ucskip
+                else:
+                    c = int(arg)
+                    if c < 0:
+                        c += 0x10000
+                    out.append(chr(c))
+                    curskip = ucskip
+        elif _hex:  # \'xx
+            if curskip > 0:
+                curskip -= 1
+            elif not ignorable:
+                hexes = hexes + _hex if hexes else _hex
+        elif tchar:
+            if curskip > 0:
+                curskip -= 1
+            elif not ignorable:
+                out.append(tchar)
+    return ''.join(out)
 
 class RTFProcessor:
-    def __init__(self):
-        """Initialize with default boilerplate patterns"""
-        self.boilerplate_patterns = [
-            # SAS system output headers/footers
-            r'Version \d+\.\d+ SAS System Output',
-            r'CONFIDENTIAL',
-            r'Program \[SC\]:.*',
-            r'Page \d+ of \d+',
-            r'Generated on:?\s*\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
-            r'Created on:?\s*\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
-            r'Updated on:?\s*\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
-            r'Printed on:?\s*\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
-            r'Generated at:?\s*\d{2}/\d{2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
-            r'Created at:?\s*\d{2}/\d{2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
-            r'Updated at:?\s*\d{2}/\d{2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
-            r'Printed at:?\s*\d{2}/\d{2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
-            r'\d{1,2}-[A-Za-z]{3}-\d{4}(\s+\d{2}:\d{2}:\d{2})?',
-            r'\d{1,2}/\d{1,2}/\d{4}(\s+\d{1,2}:\d{2}(\s*[APap][Mm])?)?',
-            r'\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}:\d{2})?',
-            # Table pagination and metadata
-            r'Table \d+\.\d+(\.\d+)?',
-            r'Listing \d+\.\d+(\.\d+)?',
-            r'Figure \d+\.\d+(\.\d+)?',
-            r'^\s*-+\s*$',  # Separator lines
-            r'^\s*=+\s*$',  # Separator lines
-            r'Study:\s*\w+',
-            r'Protocol:\s*\w+',
-            r'Output Date:.*',
-            r'Run Date:.*',
-            r'File Path:.*',
-            r'Program Name:.*',
-        ]
+    # Default boilerplate matching, compiled once and shared by all processors;
+    # custom patterns override these attributes per instance
+    boilerplate_patterns = DEFAULT_BOILERPLATE_PATTERNS
+    _boilerplate_re = re.compile(
+        '|'.join(f'(?:{pattern})' for pattern in DEFAULT_BOILERPLATE_PATTERNS),
+        re.IGNORECASE
+    )
+    # Trigger prefilter and re2 are only known to be exact for the default patterns
+    _boilerplate_triggers = _DEFAULT_BOILERPLATE_TRIGGERS
+    _ascii_boilerplate_search = (_DEFAULT_BOILERPLATE_RE2 or _boilerplate_re).search
+    
+    def _set_boilerplate_patterns(self, patterns):
+        """
+        Combine custom boilerplate patterns into one case-insensitive
+        alternation so each line is scanned once
+        """
+        self._boilerplate_re = re.compile(
+            '|'.join(f'(?:{pattern})' for pattern in patterns),
+            re.IGNORECASE
+        )
+        self.boilerplate_patterns = patterns
+        self._boilerplate_triggers = None
+        self._ascii_boilerplate_search = self._boilerplate_re.search
     
     def process_file(self, file_path, options):
         """
@@ -52,14 +241,8 @@ class RTFProcessor:
         Returns:
             Processed text string
         """
-        try:
-            # Read RTF file with encoding handling
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                rtf_content = f.read()
-        except UnicodeDecodeError:
-            # Try with Windows-1252 encoding
-            with open(file_path, 'r', encoding='windows-1252', errors='ignore') as f:
-                rtf_content = f.read()
+        # Read RTF file once as bytes and decode it once
+        rtf_content = self._decode_rtf(Path(file_path).read_bytes())
         
         # Convert RTF to plain text
         try:
@@ -68,12 +251,17 @@ class RTFProcessor:
             # Fallback: try to extract text manually if striprtf fails
             text = self._manual_rtf_extract(rtf_content)
         
+        # Line passes share one list of lines, joined once at the end
+        lines = text.split('\n')
+        
         # Apply processing options
         if options.get('ignore_boilerplate', True):
-            text = self._remove_boilerplate(text)
+            lines = self._remove_boilerplate(lines)
         
         if options.get('normalize_whitespace', True):
-            text = self._normalize_whitespace(text)
+            lines = self._normalize_whitespace(lines)
+        
+        text = '\n'.join(lines)
         
         if options.get('ignore_case', False):
             text = text.lower()
@@ -83,22 +271,38 @@ class RTFProcessor:
         
         return text
     
+    def _decode_rtf(self, raw):
+        """
+        Decode raw RTF bytes: UTF-8 (which covers plain 7-bit RTF), otherwise
+        the document's declared \\ansicpg code page, defaulting to Windows-1252
+        """
+        try:
+            return raw.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+        
+        encoding = 'cp1252'
+        match = _ANSICPG_RE.search(raw, 0, 4096)
+        if match:
+            try:
+                encoding = codecs.lookup(f"cp{match.group(1).decode('ascii')}").name
+            except LookupError:
+                pass
+        return raw.decode(encoding, errors='replace')
+    
     def _manual_rtf_extract(self, rtf_content):
         """
         Manual RTF text extraction as fallback
         """
-        # Remove RTF control words and groups
-        text = re.sub(r'\\[a-z]+\d*\s?', '', rtf_content)
-        text = re.sub(r'[{}]', '', text)
-        text = re.sub(r'\\[\'"]([0-9a-f]{2})', lambda m: chr(int(m.group(1), 16)), text)
-        return text
+        # Decode hex escapes and remove control words and group braces in one pass
+        return _RTF_TOKEN_RE.sub(_replace_rtf_token, rtf_content)
     
-    def _remove_boilerplate(self, text):
+    def _remove_boilerplate(self, lines):
         """
-        Remove boilerplate patterns from text
+        Remove boilerplate lines from a list of lines
         """
-        lines = text.split('\n')
         cleaned_lines = []
+        triggers = self._boilerplate_triggers
         
         for line in lines:
             line_stripped = line.strip()
@@ -106,48 +310,59 @@ class RTFProcessor:
                 cleaned_lines.append(line)
                 continue
             
-            # Check if line matches any boilerplate pattern
-            is_boilerplate = False
-            for pattern in self.boilerplate_patterns:
-                if re.search(pattern, line_stripped, re.IGNORECASE):
-                    is_boilerplate = True
-                    break
+            # Skip the regex for plain content lines that cannot match; non-ASCII
+            # lines go to the regex since case-insensitive matching folds them
+            is_ascii = line_stripped.isascii()
+            if (triggers and is_ascii
+                    and line_stripped[0] not in '-='
+                    and not _DIGIT_RE.search(line_stripped)):
+                lowered = line_stripped.lower()
+                if not any(trigger in lowered for trigger in triggers):
+                    cleaned_lines.append(line)
+                    continue
             
-            if not is_boilerplate:
+            # Check if line matches any boilerplate pattern
+            search = self._ascii_boilerplate_search if is_ascii else self._boilerplate_re.search
+            if not search(line_stripped):
                 cleaned_lines.append(line)
         
-        return '\n'.join(cleaned_lines)
+        return cleaned_lines
     
-    def _normalize_whitespace(self, text):
+    def _normalize_whitespace(self, lines):
         """
-        Normalize whitespace and line endings
+        Normalize whitespace and line endings in a list of lines
         """
-        # Convert Windows line endings to Unix
-        text = text.replace('\r\n', '\n').replace('\r', '\n')
-        
-        # Remove excessive whitespace but preserve structure
-        lines = text.split('\n')
         normalized_lines = []
+        last_index = len(lines) - 1
         
-        for line in lines:
-            # Normalize internal whitespace
-            normalized_line = ' '.join(line.split())
-            normalized_lines.append(normalized_line)
+        for index, line in enumerate(lines):
+            if '\r' in line:
+                # Convert Windows (\r\n, already split at \n) and old Mac
+                # line endings to Unix
+                if line.endswith('\r') and index < last_index:
+                    line = line[:-1]
+                # Remove excessive whitespace but preserve structure (str.split/join
+                # runs in C and measures faster here than regex substitution)
+                normalized_lines.extend(' '.join(part.split()) for part in line.split('\r'))
+            else:
+                normalized_lines.append(' '.join(line.split()))
         
-        return '\n'.join(normalized_lines)
+        return normalized_lines
     
     def _remove_punctuation(self, text):
         """
         Remove punctuation for comparison
         """
         # Keep alphanumeric and essential whitespace
-        return re.sub(r'[^\w\s]', '', text)
+        if text.isascii():
+            return text.translate(_ASCII_PUNCTUATION_TABLE)
+        return _PUNCTUATION_RE.sub('', text)
     
     def add_boilerplate_pattern(self, pattern):
         """
         Add custom boilerplate pattern
         """
-        self.boilerplate_patterns.append(pattern)
+        self._set_boilerplate_patterns([*self.boilerplate_patterns, pattern])
     
     def load_boilerplate_config(self, config_path):
         """
@@ -157,6 +372,8 @@ class RTFProcessor:
             with open(config_path, 'r') as f:
                 config = yaml.safe_load(f)
                 if 'boilerplate_patterns' in config:
-                    self.boilerplate_patterns.extend(config['boilerplate_patterns'])
+                    self._set_boilerplate_patterns(
+                        [*self.boilerplate_patterns, *config['boilerplate_patterns']]
+                    )
         except Exception as e:
             print(f"Warning: Could not load boilerplate config: {e}")